@@ -1,11 +1,8 @@
+from functools import lru_cache
 from pydantic_settings import BaseSettings
 from typing import Optional
-from dotenv import load_dotenv
 import os
 
-# Load .env file explicitly
-load_dotenv()
-
 
 class Settings(BaseSettings):
     """Application settings loaded from environment variables."""
@@ -26,12 +23,16 @@ class Settings(BaseSettings):
     redis_db: int = 0
     redis_password: Optional[str] = None
     redis_use_ssl: bool = False
+    redis_pool_size: int = 20  # Max pooled Redis connections per worker
     session_ttl: int = 86400  # 24 hours in seconds
+    max_fallback_sessions: int = 10000  # In-memory fallback cap; least recently used are evicted
+    session_cache_ttl: int = 0  # In-process session cache; only honoured with a single worker
 
     # FastAPI Configuration
     host: str = "0.0.0.0"
     port: int = 8000
     debug: bool = True
+    workers: Optional[int] = None  # Defaults to max(2, CPU count); debug mode always runs one
 
     # Security
     secret_key: str
@@ -40,17 +41,33 @@ class Settings(BaseSettings):
         env_file = ".env"
         case_sensitive = False
 
+    @property
+    def worker_count(self) -> int:
+        """
+        Number of server worker processes configured for production.
+
+        Debug mode isn't taken into account, since the app can still be served by
+        several workers; per-worker state is only safe when this is 1.
+        """
+        return self.workers or max(2, os.cpu_count() or 1)
+
+
+@lru_cache
+def get_settings() -> Settings:
+    """Get the application settings, loading them on first use."""
+    return Settings()
+
 
-# Global settings instance
-settings = Settings()
+if __name__ == "__main__":
+    settings = get_settings()
 
-# Debug: Print loaded configuration (without sensitive data)
-print(f"🔧 Configuration loaded:")
-print(f"   - OpenAI Model: {settings.openai_model}")
-print(f"   - Host: {settings.host}")
-print(f"   - Port: {settings.port}")
-print(f"   - Redis Host: {settings.redis_host}")
-print(f"   - Redis Port: {settings.redis_port}")
-print(f"   - Session TTL: {settings.session_ttl} seconds")
-print(f"   - Debug Mode: {settings.debug}")
-print(f"   - .env file loaded: {os.path.exists('.env')}")
+    # Debug: Print loaded configuration (without sensitive data)
+    print(f"🔧 Configuration loaded:")
+    print(f"   - OpenAI Model: {settings.openai_model}")
+    print(f"   - Host: {settings.host}")
+    print(f"   - Port: {settings.port}")
+    print(f"   - Redis Host: {settings.redis_host}")
+    print(f"   - Redis Port: {settings.redis_port}")
+    print(f"   - Session TTL: {settings.session_ttl} seconds")
+    print(f"   - Debug Mode: {settings.debug}")
+    print(f"   - .env file loaded: {os.path.exists('.env')}")
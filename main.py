@@ -1,39 +1,114 @@
-from fastapi import FastAPI, Request, HTTPException, Depends, Form
+from fastapi import FastAPI, Request, HTTPException
 from fastapi.responses import Response, HTMLResponse
-from fastapi.middleware.cors import CORSMiddleware
-from typing import Optional
+from starlette.background import BackgroundTask
+from starlette.routing import Route, Router
+from contextlib import asynccontextmanager
+import asyncio
+import atexit
+import httpx
 import logging
+import queue
 import uvicorn
+from logging.handlers import QueueHandler, QueueListener
+from urllib.parse import parse_qs
 
-from config import settings
-from models import TwilioWebhookRequest, HealthCheck
+from config import get_settings
+from models import HealthCheck
 from services.chat_service import ChatService
 from services.twilio_service import TwilioService
 from datetime import datetime
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging: records are queued on the event loop thread and
+# written to the stream by a background listener thread
+log_queue = queue.SimpleQueue()
+logging.basicConfig(level=logging.INFO, handlers=[QueueHandler(log_queue)])
+log_listener = QueueListener(log_queue, logging.StreamHandler())
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 
+
+class CORSLite:
+    """
+    Minimal pure-ASGI CORS middleware allowing any origin.
+
+    Avoids the per-request call chain of Starlette's CORSMiddleware: the CORS
+    headers and the preflight response are built once and reused for every request.
+    Requests under `skip_paths` are passed through untouched.
+    """
+
+    def __init__(self, app, skip_paths: tuple = ()):
+        self.app = app
+        self.skip_paths = skip_paths
+        self.cors_headers = [
+            (b"access-control-allow-origin", b"*"),
+        ]
+        self.preflight_headers = self.cors_headers + [
+            (b"access-control-allow-methods", b"DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT"),
+            (b"access-control-allow-headers", b"*"),
+            (b"access-control-max-age", b"600"),
+            (b"content-length", b"0"),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.skip_paths):
+            await self.app(scope, receive, send)
+            return
+
+        # Answer preflight requests directly
+        if scope["method"] == "OPTIONS":
+            await send({"type": "http.response.start", "status": 204, "headers": self.preflight_headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def send_with_cors(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), *self.cors_headers]
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Connect session storage and run periodic session cleanup for the app's lifetime."""
+    await chat_service.session_storage.initialize()
+    cleanup_task = asyncio.create_task(chat_service.run_cleanup_loop())
+    try:
+        yield
+    finally:
+        cleanup_task.cancel()
+        await chat_service.session_storage.close()
+        await http_client.aclose()
+
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Agentic WhatsApp Chatbot",
     description="A WhatsApp chatbot powered by FastAPI, Twilio, and OpenAI",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+app.add_middleware(CORSLite, skip_paths=("/webhook/",))
+
+# Shared HTTP client with pooled keep-alive connections for OpenAI and Twilio
+http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=64, keepalive_expiry=60),
+    timeout=httpx.Timeout(15.0, connect=3.0)
 )
 
 # Initialize services
-chat_service = ChatService()
-twilio_service = TwilioService()
+chat_service = ChatService(http_client)
+twilio_service = TwilioService(http_client)
+
+# Pre-rendered TwiML responses for the webhook
+ACK_TWIML = b"<?xml version='1.0' encoding='UTF-8'?><Response/>"
+ERROR_TWIML = twilio_service.create_twiml_response(
+    "I'm sorry, I'm having trouble processing your message right now. Please try again later."
+).encode()
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -86,73 +161,95 @@ async def health_check():
     )
 
 
-@app.post("/webhook/twilio")
-async def twilio_webhook(
-    request: Request,
-    From: str = Form(...),
-    To: str = Form(...),
-    Body: str = Form(...),
-    MessageSid: str = Form(...),
-    NumMedia: Optional[str] = Form(None),
-    MediaUrl0: Optional[str] = Form(None),
-    MessageTimestamp: Optional[str] = Form(None)
-):
+async def _handle_and_reply(user_phone: str, message: str):
+    """Process an incoming message and deliver the reply via the Twilio REST API."""
+    try:
+        formatted_phone = twilio_service.format_phone_number(user_phone)
+
+        # Send each part of the streamed reply as an outbound WhatsApp message as soon as it is ready
+        async for response_part in chat_service.stream_message(user_phone, message):
+            if await twilio_service.send_message_async(formatted_phone, response_part):
+                logger.info("Response sent to %s: %s...", user_phone, response_part[:50])
+            else:
+                logger.warning("Failed to deliver response to %s", user_phone)
+
+    except Exception as e:
+        logger.error("Error handling message from %s: %s", user_phone, e)
+
+
+async def twilio_webhook(request: Request) -> Response:
     """
     Twilio webhook endpoint for incoming WhatsApp messages.
 
     This endpoint receives webhooks from Twilio when users send messages to the WhatsApp number.
-    It processes the message through OpenAI and sends a response back via Twilio.
+    It acknowledges the webhook immediately with an empty TwiML response and processes the
+    message through OpenAI in a background task, sending the reply back via the Twilio API.
+    The form body is parsed directly to keep the hot path free of FastAPI validation.
     """
     try:
+        # Decode before parsing; parse_qs re-encodes bytes input as ASCII and fails on non-ASCII text
+        form = parse_qs((await request.body()).decode(), keep_blank_values=True, max_num_fields=64)
+        if not all(field in form for field in ("From", "Body", "MessageSid")):
+            logger.warning("Rejecting webhook without From, Body or MessageSid")
+            return Response(status_code=400)
+
+        from_number = form["From"][0]
+        body = form["Body"][0]
+        message_sid = form["MessageSid"][0]
+
         # Log incoming webhook
-        logger.info(f"Received webhook from {From}: {Body[:50]}...")
+        logger.info("Received webhook from %s: %s...", from_number, body[:50])
+
+        # Acknowledge retried deliveries without replying twice
+        if not await chat_service.claim_message(message_sid):
+            logger.info("Ignoring duplicate webhook for message %s", message_sid)
+            return Response(
+                content=ACK_TWIML,
+                media_type="application/xml"
+            )
 
         # Validate webhook signature (optional but recommended for production)
         # signature = request.headers.get("X-Twilio-Signature")
         # if signature:
-        #     if not twilio_service.validate_webhook_signature(signature, str(request.url), dict(request.form())):
+        #     params = {key: values[0] for key, values in form.items()}
+        #     if not twilio_service.validate_webhook_signature(signature, str(request.url), params):
         #         logger.warning("Invalid webhook signature")
-        #         raise HTTPException(status_code=403, detail="Invalid signature")
+        #         return Response(status_code=403)
 
         # Extract user phone number (remove whatsapp: prefix)
-        user_phone = From.replace("whatsapp:", "")
-
-        # Process the message through chat service
-        response_message = await chat_service.process_message(user_phone, Body)
-
-        # Create TwiML response
-        twiml_response = twilio_service.create_twiml_response(response_message)
-
-        logger.info(f"Response sent to {user_phone}: {response_message[:50]}...")
+        user_phone = from_number.removeprefix("whatsapp:")
 
+        # Process the message after the response has been returned to Twilio
         return Response(
-            content=twiml_response,
-            media_type="application/xml"
+            content=ACK_TWIML,
+            media_type="application/xml",
+            background=BackgroundTask(_handle_and_reply, user_phone, body)
         )
 
     except Exception as e:
-        logger.error(f"Error processing webhook: {e}")
+        logger.error("Error processing webhook: %s", e)
         # Return a simple error response
-        error_response = twilio_service.create_twiml_response(
-            "I'm sorry, I'm having trouble processing your message right now. Please try again later."
-        )
         return Response(
-            content=error_response,
+            content=ERROR_TWIML,
             media_type="application/xml"
         )
 
 
+# Webhooks are served by a bare Starlette router without FastAPI validation, docs or CORS handling
+app.mount("/webhook", Router(routes=[Route("/twilio", twilio_webhook, methods=["POST"])]))
+
+
 @app.get("/sessions")
 async def get_sessions_info():
     """Get information about active chat sessions."""
     try:
-        active_count = chat_service.get_active_sessions_count()
+        active_count = await chat_service.get_active_sessions_count()
         return {
             "active_sessions": active_count,
             "timestamp": datetime.now().isoformat()
         }
     except Exception as e:
-        logger.error(f"Error getting sessions info: {e}")
+        logger.error("Error getting sessions info: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
@@ -160,13 +257,13 @@ async def get_sessions_info():
 async def get_storage_status():
     """Get storage status information (Redis connection, fallback storage, etc.)."""
     try:
-        storage_status = chat_service.get_storage_status()
+        storage_status = await chat_service.get_storage_status()
         return {
             "storage_status": storage_status,
             "timestamp": datetime.now().isoformat()
         }
     except Exception as e:
-        logger.error(f"Error getting storage status: {e}")
+        logger.error("Error getting storage status: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
@@ -174,7 +271,7 @@ async def get_storage_status():
 async def get_session_info(user_phone: str):
     """Get information about a specific user's chat session."""
     try:
-        session_info = chat_service.get_session_info(user_phone)
+        session_info = await chat_service.get_session_info(user_phone)
         if session_info:
             return session_info
         else:
@@ -182,7 +279,22 @@ async def get_session_info(user_phone: str):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error getting session info for {user_phone}: {e}")
+        logger.error("Error getting session info for %s: %s", user_phone, e)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
+@app.delete("/sessions/all")
+async def clear_all_sessions():
+    """Clear all chat sessions."""
+    try:
+        cleared_count = await chat_service.clear_all_sessions()
+
+        return {
+            "message": f"Cleared {cleared_count} sessions",
+            "cleared_count": cleared_count
+        }
+    except Exception as e:
+        logger.error("Error clearing all sessions: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
@@ -190,7 +302,7 @@ async def get_session_info(user_phone: str):
 async def clear_session(user_phone: str):
     """Clear a user's chat session."""
     try:
-        success = chat_service.clear_session(user_phone)
+        success = await chat_service.clear_session(user_phone)
         if success:
             return {"message": f"Session cleared for {user_phone}"}
         else:
@@ -198,28 +310,7 @@ async def clear_session(user_phone: str):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error clearing session for {user_phone}: {e}")
-        raise HTTPException(status_code=500, detail="Internal server error")
-
-
-@app.delete("/sessions/all")
-async def clear_all_sessions():
-    """Clear all chat sessions."""
-    try:
-        # Get all sessions and clear them
-        all_sessions = chat_service.session_storage.get_all_sessions()
-        cleared_count = 0
-
-        for user_phone in all_sessions.keys():
-            if chat_service.clear_session(user_phone):
-                cleared_count += 1
-
-        return {
-            "message": f"Cleared {cleared_count} sessions",
-            "cleared_count": cleared_count
-        }
-    except Exception as e:
-        logger.error(f"Error clearing all sessions: {e}")
+        logger.error("Error clearing session for %s: %s", user_phone, e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
@@ -235,7 +326,7 @@ async def send_message(user_phone: str, message: str):
         formatted_phone = twilio_service.format_phone_number(user_phone)
 
         # Send message via Twilio
-        success = twilio_service.send_message(formatted_phone, message)
+        success = await twilio_service.send_message_async(formatted_phone, message)
 
         if success:
             return {"message": f"Message sent to {user_phone}"}
@@ -245,14 +336,28 @@ async def send_message(user_phone: str, message: str):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error sending message to {user_phone}: {e}")
+        logger.error("Error sending message to %s: %s", user_phone, e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
 if __name__ == "__main__":
-    uvicorn.run(
-        "main:app",
-        host=settings.host,
-        port=settings.port,
-        reload=settings.debug
-    )
+    settings = get_settings()
+    if settings.debug:
+        # Single auto-reloading worker for development
+        uvicorn.run(
+            "main:app",
+            host=settings.host,
+            port=settings.port,
+            loop="uvloop",
+            http="httptools",
+            reload=True
+        )
+    else:
+        uvicorn.run(
+            "main:app",
+            host=settings.host,
+            port=settings.port,
+            loop="uvloop",
+            http="httptools",
+            workers=settings.worker_count
+        )
@@ -1,20 +1,9 @@
-from pydantic import BaseModel, Field
+from dataclasses import dataclass, field
+import msgspec
+from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 from datetime import datetime
-
-
-class TwilioWebhookRequest(BaseModel):
-    """Model for incoming Twilio webhook requests."""
-    message_sid: str = Field(..., alias="MessageSid")
-    from_: str = Field(..., alias="From")
-    to: str = Field(..., alias="To")
-    body: str = Field(..., alias="Body")
-    num_media: Optional[str] = Field(None, alias="NumMedia")
-    media_url: Optional[str] = Field(None, alias="MediaUrl0")
-    timestamp: Optional[str] = Field(None, alias="MessageTimestamp")
-
-    class Config:
-        allow_population_by_field_name = True
+import time
 
 
 class TwilioResponse(BaseModel):
@@ -23,11 +12,16 @@ class TwilioResponse(BaseModel):
     media_url: Optional[str] = None
 
 
-class OpenAIMessage(BaseModel):
+@dataclass
+class OpenAIMessage:
     """Model for OpenAI API message format."""
     role: str
     content: str
 
+    def to_dict(self) -> Dict[str, str]:
+        """Get the message in OpenAI request format."""
+        return {"role": self.role, "content": self.content}
+
 
 class OpenAIRequest(BaseModel):
     """Model for OpenAI API request."""
@@ -47,22 +41,52 @@ class OpenAIResponse(BaseModel):
     usage: Dict[str, int]
 
 
-class ChatSession(BaseModel):
+@dataclass
+class ChatSession:
     """Model for chat session management."""
     user_phone: str
-    messages: List[OpenAIMessage] = []
-    created_at: datetime = Field(default_factory=datetime.now)
-    last_activity: datetime = Field(default_factory=datetime.now)
+    messages: List[OpenAIMessage] = field(default_factory=list)
+    # Unix timestamps in whole seconds
+    created_at: int = field(default_factory=lambda: int(time.time()))
+    last_activity: int = field(default_factory=lambda: int(time.time()))
+
+    # Number of leading messages already saved to session storage
+    stored_message_count: int = field(default=0, repr=False, compare=False)
+
+    # Messages in OpenAI request format, kept in sync with `messages`
+    _message_dicts: List[Dict[str, str]] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self._message_dicts = [msg.to_dict() for msg in self.messages]
 
     def add_message(self, role: str, content: str):
         """Add a message to the session."""
-        self.messages.append(OpenAIMessage(role=role, content=content))
-        self.last_activity = datetime.now()
+        self.messages.append(OpenAIMessage(role, content))
+        self._message_dicts.append({"role": role, "content": content})
+        self.last_activity = int(time.time())
+
+    @property
+    def message_dicts(self) -> List[Dict[str, str]]:
+        """Get all messages in OpenAI request format."""
+        return self._message_dicts
 
     def get_conversation_history(self, max_messages: int = 10) -> List[OpenAIMessage]:
         """Get recent conversation history."""
         return self.messages[-max_messages:] if len(self.messages) > max_messages else self.messages
 
+    def get_conversation_dicts(self, max_messages: int = 10) -> List[Dict[str, str]]:
+        """Get recent conversation history in OpenAI request format."""
+        return self._message_dicts[-max_messages:]
+
+
+class Session(msgspec.Struct):
+    """Model for chat session data as persisted in session storage."""
+    user_phone: str
+    messages: List[Dict[str, str]]
+    # Unix timestamps in whole seconds
+    created_at: int
+    last_activity: int
+
 
 class HealthCheck(BaseModel):
     """Model for health check response."""
@@ -1,25 +1,64 @@
-from typing import Dict, Optional, List
-from models import ChatSession, OpenAIMessage
+from typing import AsyncIterator, Dict, Optional, List, Tuple
+import httpx
+from models import ChatSession, OpenAIMessage, Session
 from services.openai_service import OpenAIService
 from services.twilio_service import TwilioService
 from services.session_storage import SessionStorage
+from config import get_settings
+import asyncio
 import logging
-from datetime import datetime, timedelta
+import re
+import time
+from contextlib import asynccontextmanager
+from weakref import WeakValueDictionary
+from datetime import datetime
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# End of a sentence: terminal punctuation followed by whitespace, or a line break
+_SENTENCE_END_RE = re.compile(r"[.!?](?=\s)|\n")
+
 
 class ChatService:
     """Service class for managing chat sessions and coordinating between Twilio and OpenAI."""
 
-    def __init__(self):
-        self.openai_service = OpenAIService()
-        self.twilio_service = TwilioService()
-        self.session_storage = SessionStorage()
+    # Minimum length of a streamed response part; shorter responses are sent whole
+    _STREAM_MIN_CHARS = 80
 
-    def get_or_create_session(self, user_phone: str) -> ChatSession:
+    def __init__(self, http_client: Optional[httpx.AsyncClient] = None):
+        self.openai_service = OpenAIService(http_client)
+        self.twilio_service = TwilioService(http_client)
+        self.session_storage = SessionStorage()
+        # Seconds a saved session is served from the in-process cache before storage is read again.
+        # Workers don't share the cache, so it would serve stale history with more than one worker
+        settings = get_settings()
+        self._cache_ttl = settings.session_cache_ttl if settings.worker_count == 1 else 0
+        if settings.session_cache_ttl and not self._cache_ttl:
+            logger.warning("Session cache disabled: running %d workers", settings.worker_count)
+        self._session_cache: Dict[str, Tuple[float, ChatSession]] = {}
+        self._user_locks: "WeakValueDictionary[str, asyncio.Lock]" = WeakValueDictionary()
+
+    def _get_user_lock(self, user_phone: str) -> asyncio.Lock:
+        """Get the lock serializing message processing for a user."""
+        lock = self._user_locks.get(user_phone)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._user_locks[user_phone] = lock
+        return lock
+
+    @asynccontextmanager
+    async def _lock_user(self, user_phone: str) -> AsyncIterator[None]:
+        """Serialize updates to a user's session within this worker and across workers."""
+        # The local lock keeps requests in this worker from polling the Redis lock
+        async with self._get_user_lock(user_phone):
+            async with self.session_storage.lock_session(user_phone):
+                yield
+
+    async def claim_message(self, message_sid: str) -> bool:
+        """Check that a MessageSid hasn't been received before and mark it as received."""
+        return await self.session_storage.claim_message(message_sid)
+
+    async def get_or_create_session(self, user_phone: str) -> ChatSession:
         """
         Get existing session or create a new one for the user.
 
@@ -29,25 +68,29 @@ class ChatService:
         Returns:
             ChatSession object
         """
-        # Clean up expired sessions
-        self._cleanup_expired_sessions()
+        # Serve recently active sessions from the in-process cache
+        cached = self._session_cache.get(user_phone)
+        if cached and time.monotonic() - cached[0] < self._cache_ttl:
+            logger.debug("Retrieved cached session for %s", user_phone)
+            return cached[1]
 
         # Try to get existing session from storage
-        session_data = self.session_storage.get_session(user_phone)
+        stored_session = await self.session_storage.get_session(user_phone)
 
-        if session_data:
+        if stored_session:
             # Reconstruct ChatSession from stored data
             session = ChatSession(
-                user_phone=session_data['user_phone'],
-                messages=[OpenAIMessage(**msg) for msg in session_data['messages']],
-                created_at=session_data['created_at'],
-                last_activity=session_data['last_activity']
+                user_phone=stored_session.user_phone,
+                messages=[OpenAIMessage(msg['role'], msg['content']) for msg in stored_session.messages],
+                created_at=stored_session.created_at,
+                last_activity=stored_session.last_activity,
+                stored_message_count=len(stored_session.messages)
             )
-            logger.debug(f"Retrieved existing session for {user_phone}")
+            logger.debug("Retrieved existing session for %s", user_phone)
             return session
         else:
             # Create new session
-            logger.info(f"Creating new chat session for {user_phone}")
+            logger.info("Creating new chat session for %s", user_phone)
             session = ChatSession(user_phone=user_phone)
 
             # Add system message to new session
@@ -55,88 +98,155 @@ class ChatService:
             session.add_message(system_message.role, system_message.content)
 
             # Save new session to storage
-            self._save_session_to_storage(session)
+            await self._save_session_to_storage(session)
 
             return session
 
-    def _save_session_to_storage(self, session: ChatSession):
+    async def _save_session_to_storage(self, session: ChatSession):
         """Save session to storage."""
         try:
-            session_data = {
-                'user_phone': session.user_phone,
-                'messages': [msg.dict() for msg in session.messages],
-                'created_at': session.created_at,
-                'last_activity': session.last_activity
-            }
+            stored_session = Session(
+                user_phone=session.user_phone,
+                messages=list(session.message_dicts),
+                created_at=session.created_at,
+                last_activity=session.last_activity
+            )
 
-            success = self.session_storage.save_session(session.user_phone, session_data)
+            success = await self.session_storage.save_session(
+                session.user_phone, stored_session, session.stored_message_count
+            )
             if success:
-                logger.debug(f"Session saved successfully for {session.user_phone}")
+                session.stored_message_count = len(stored_session.messages)
+                if self._cache_ttl:
+                    self._session_cache[session.user_phone] = (time.monotonic(), session)
+                logger.debug("Session saved successfully for %s", session.user_phone)
             else:
-                logger.warning(f"Failed to save session for {session.user_phone}")
+                logger.warning("Failed to save session for %s", session.user_phone)
 
         except Exception as e:
-            logger.error(f"Error saving session for {session.user_phone}: {e}")
+            logger.error("Error saving session for %s: %s", session.user_phone, e)
 
-    async def process_message(self, user_phone: str, message: str) -> str:
+    async def stream_message(self, user_phone: str, message: str) -> AsyncIterator[str]:
         """
-        Process incoming message and generate response.
+        Process incoming message and stream the response in sentence-sized parts.
+
+        Each part ends on a sentence boundary and is at least _STREAM_MIN_CHARS long,
+        except the last one, so each part can be sent as soon as it is generated.
+        The reply is generated in a separate task holding the user's lock, so the lock
+        is released once the reply is saved rather than after every part is delivered.
 
         Args:
             user_phone: User's phone number
             message: Incoming message content
 
-        Returns:
-            Generated response message
+        Yields:
+            Parts of the generated response message
         """
+        # Parts of the reply, followed by None once the reply is complete
+        parts: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+        reply_task = asyncio.create_task(self._stream_reply(user_phone, message, parts))
         try:
-            # Get or create session
-            session = self.get_or_create_session(user_phone)
-
-            # Add user message to session
-            session.add_message("user", message)
+            while (part := await parts.get()) is not None:
+                yield part
+        finally:
+            # Let the reply be saved even if the caller stops consuming parts early
+            await reply_task
 
-            # Get conversation history
-            conversation_history = session.get_conversation_history()
-
-            logger.info(f"Processing message for {user_phone}: {len(message)} characters")
-
-            # Generate AI response
-            ai_response = await self.openai_service.generate_response(
-                messages=conversation_history,
-                max_tokens=500,  # Keep responses concise for WhatsApp
-                temperature=0.7
-            )
-
-            if ai_response:
-                # Add AI response to session
-                session.add_message("assistant", ai_response)
-
-                # Save updated session to storage
-                self._save_session_to_storage(session)
-
-                logger.info(f"AI response generated for {user_phone}: {len(ai_response)} characters")
-                return ai_response
-            else:
-                # Fallback response if AI fails
-                fallback_response = "I'm sorry, I'm having trouble processing your message right now. Please try again in a moment."
-                logger.warning(f"AI response generation failed for {user_phone}, using fallback")
-                return fallback_response
-
-        except Exception as e:
-            logger.error(f"Error processing message for {user_phone}: {e}")
-            return "I'm sorry, something went wrong. Please try again later."
+    async def _stream_reply(self, user_phone: str, message: str, parts: "asyncio.Queue[Optional[str]]"):
+        """
+        Add a message to the user's session and stream the AI response into a queue.
 
-    def _cleanup_expired_sessions(self):
+        Args:
+            user_phone: User's phone number
+            message: Incoming message content
+            parts: Queue receiving each part of the response, then None
+        """
+        try:
+            async with self._lock_user(user_phone):
+                ai_response = ""
+                try:
+                    # Get or create session and add user message
+                    session = await self.get_or_create_session(user_phone)
+                    session.add_message("user", message)
+                    conversation_history = session.get_conversation_dicts()
+
+                    logger.debug("Streaming response for %s: %s characters", user_phone, len(message))
+
+                    buffer = ""
+                    async for delta in self.openai_service.stream_response(
+                        messages=conversation_history,
+                        max_tokens=500,  # Keep responses concise for WhatsApp
+                        temperature=0.7
+                    ):
+                        ai_response += delta
+                        buffer += delta
+                        if len(buffer) >= self._STREAM_MIN_CHARS:
+                            split_at = self._sentence_split_index(buffer)
+                            if split_at >= self._STREAM_MIN_CHARS:
+                                part, buffer = buffer[:split_at].strip(), buffer[split_at:]
+                                if part:
+                                    parts.put_nowait(part)
+
+                    if buffer.strip():
+                        parts.put_nowait(buffer.strip())
+
+                    if ai_response:
+                        session.add_message("assistant", ai_response)
+                        await self._save_session_to_storage(session)
+                        logger.debug("AI response streamed for %s: %s characters", user_phone, len(ai_response))
+                    else:
+                        self._session_cache.pop(user_phone, None)
+                        logger.warning("AI response generation failed for %s, using fallback", user_phone)
+                        parts.put_nowait(
+                            "I'm sorry, I'm having trouble processing your message right now. Please try again in a moment."
+                        )
+
+                except Exception as e:
+                    # The session isn't saved, so a cut-off response never becomes part of the history
+                    self._session_cache.pop(user_phone, None)
+                    logger.error("Error streaming message for %s: %s", user_phone, e)
+                    if ai_response:
+                        parts.put_nowait("I'm sorry, my reply was cut off. Please try again.")
+                    else:
+                        parts.put_nowait("I'm sorry, something went wrong. Please try again later.")
+        finally:
+            parts.put_nowait(None)
+
+    @staticmethod
+    def _sentence_split_index(text: str) -> int:
+        """Get the index just past the last complete sentence in text, or 0 if there is none."""
+        split_at = 0
+        for match in _SENTENCE_END_RE.finditer(text):
+            split_at = match.end()
+        return split_at
+
+    async def _cleanup_expired_sessions(self):
         """Remove expired chat sessions to prevent memory leaks."""
         try:
-            expired_count = self.session_storage.cleanup_expired_sessions()
+            # Drop stale entries from the in-process session cache
+            now = time.monotonic()
+            for user_phone, (cached_at, _) in list(self._session_cache.items()):
+                if now - cached_at >= self._cache_ttl:
+                    del self._session_cache[user_phone]
+
+            expired_count = await self.session_storage.cleanup_expired_sessions()
             if expired_count > 0:
-                logger.info(f"Cleaned up {expired_count} expired sessions")
+                logger.info("Cleaned up %s expired sessions", expired_count)
         except Exception as e:
-            logger.error(f"Error during session cleanup: {e}")
+            logger.error("Error during session cleanup: %s", e)
 
-    def get_session_info(self, user_phone: str) -> Optional[Dict]:
+    async def run_cleanup_loop(self, interval: int = 300):
+        """
+        Periodically clean up expired sessions outside the request path.
+
+        Args:
+            interval: Seconds to wait between cleanups
+        """
+        while True:
+            await asyncio.sleep(interval)
+            await self._cleanup_expired_sessions()
+
+    async def get_session_info(self, user_phone: str) -> Optional[Dict]:
         """
         Get information about a user's chat session.
 
@@ -147,21 +257,21 @@ class ChatService:
             Session information dictionary or None if not found
         """
         try:
-            session_data = self.session_storage.get_session(user_phone)
-            if session_data:
+            stored_session = await self.session_storage.get_session(user_phone)
+            if stored_session:
                 return {
-                    "user_phone": session_data['user_phone'],
-                    "message_count": len(session_data['messages']),
-                    "created_at": session_data['created_at'].isoformat(),
-                    "last_activity": session_data['last_activity'].isoformat(),
-                    "is_active": datetime.now() - session_data['last_activity'] < timedelta(seconds=86400)
+                    "user_phone": stored_session.user_phone,
+                    "message_count": len(stored_session.messages),
+                    "created_at": datetime.fromtimestamp(stored_session.created_at).isoformat(),
+                    "last_activity": datetime.fromtimestamp(stored_session.last_activity).isoformat(),
+                    "is_active": int(time.time()) - stored_session.last_activity < 86400
                 }
             return None
         except Exception as e:
-            logger.error(f"Error getting session info for {user_phone}: {e}")
+            logger.error("Error getting session info for %s: %s", user_phone, e)
             return None
 
-    def clear_session(self, user_phone: str) -> bool:
+    async def clear_session(self, user_phone: str) -> bool:
         """
         Clear a user's chat session.
 
@@ -172,31 +282,42 @@ class ChatService:
             True if session was cleared, False if not found
         """
         try:
-            success = self.session_storage.delete_session(user_phone)
+            # Wait for any reply in progress so its save doesn't race the deletion
+            async with self._lock_user(user_phone):
+                self._session_cache.pop(user_phone, None)
+                success = await self.session_storage.delete_session(user_phone)
             if success:
-                logger.info(f"Cleared chat session for {user_phone}")
+                logger.info("Cleared chat session for %s", user_phone)
                 return True
             return False
         except Exception as e:
-            logger.error(f"Error clearing session for {user_phone}: {e}")
+            logger.error("Error clearing session for %s: %s", user_phone, e)
             return False
 
-    def get_active_sessions_count(self) -> int:
+    async def clear_all_sessions(self) -> int:
+        """
+        Clear every chat session.
+
+        Returns:
+            Number of sessions cleared
+        """
+        self._session_cache.clear()
+        return await self.session_storage.delete_all_sessions()
+
+    async def get_active_sessions_count(self) -> int:
         """Get the number of active chat sessions."""
         try:
-            self._cleanup_expired_sessions()
-            all_sessions = self.session_storage.get_all_sessions()
-            return len(all_sessions)
+            return await self.session_storage.count_sessions()
         except Exception as e:
-            logger.error(f"Error getting active sessions count: {e}")
+            logger.error("Error getting active sessions count: %s", e)
             return 0
 
-    def get_storage_status(self) -> Dict:
+    async def get_storage_status(self) -> Dict:
         """Get storage status information."""
         try:
-            return self.session_storage.get_storage_status()
+            return await self.session_storage.get_storage_status()
         except Exception as e:
-            logger.error(f"Error getting storage status: {e}")
+            logger.error("Error getting storage status: %s", e)
             return {
                 "storage_type": "unknown",
                 "redis_connected": False,
@@ -1,27 +1,41 @@
+import httpx
 import openai
-from typing import List, Optional
+from typing import AsyncIterator, Dict, List, Optional
 from models import OpenAIMessage, OpenAIRequest, OpenAIResponse
-from config import settings
+from config import get_settings
 import logging
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Configure OpenAI client
-openai.api_key = settings.openai_api_key
+# Completions can take far longer than Twilio API calls; overrides the shared HTTP client's timeout
+OPENAI_TIMEOUT = httpx.Timeout(60.0, connect=3.0)
+
+SYSTEM_PROMPT = """You are a helpful and friendly WhatsApp chatbot assistant.
+        You should be conversational, concise, and helpful.
+        Keep responses under 500 characters when possible, as this is for WhatsApp messaging.
+        Be polite, professional, and engaging in your responses."""
 
 
 class OpenAIService:
     """Service class for OpenAI API interactions."""
 
-    def __init__(self):
+    def __init__(self, http_client: Optional[httpx.AsyncClient] = None):
+        settings = get_settings()
         self.model = settings.openai_model
-        self.client = openai.OpenAI(api_key=settings.openai_api_key)
+        # Keep connections to the API alive so concurrent requests reuse them
+        if http_client is None:
+            http_client = openai.DefaultAsyncHttpxClient(
+                http2=True,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=64, keepalive_expiry=60)
+            )
+        self.client = openai.AsyncOpenAI(
+            api_key=settings.openai_api_key, http_client=http_client, timeout=OPENAI_TIMEOUT
+        )
+        self._system_message = OpenAIMessage(role="system", content=SYSTEM_PROMPT)
 
     async def generate_response(
         self,
-        messages: List[OpenAIMessage],
+        messages: List[Dict[str, str]],
         max_tokens: int = 1000,
         temperature: float = 0.7
     ) -> Optional[str]:
@@ -29,7 +43,7 @@ class OpenAIService:
         Generate a response using OpenAI API.
 
         Args:
-            messages: List of conversation messages
+            messages: List of conversation messages in OpenAI request format
             max_tokens: Maximum tokens for response
             temperature: Response creativity (0.0 to 1.0)
 
@@ -40,19 +54,19 @@ class OpenAIService:
             # Prepare the request
             request_data = {
                 "model": self.model,
-                "messages": [msg.dict() for msg in messages],
+                "messages": messages,
                 "max_tokens": max_tokens,
                 "temperature": temperature
             }
 
-            logger.info(f"Making OpenAI API request with {len(messages)} messages")
+            logger.debug("Making OpenAI API request with %s messages", len(messages))
 
             # Make the API call
-            response = self.client.chat.completions.create(**request_data)
+            response = await self.client.chat.completions.create(**request_data)
 
             if response.choices and len(response.choices) > 0:
                 content = response.choices[0].message.content
-                logger.info(f"OpenAI response generated successfully: {len(content)} characters")
+                logger.debug("OpenAI response generated successfully: %s characters", len(content))
                 return content
             else:
                 logger.error("OpenAI response contained no choices")
@@ -65,20 +79,70 @@ class OpenAIService:
             logger.error("OpenAI rate limit exceeded. Please try again later.")
             return None
         except openai.APIError as e:
-            logger.error(f"OpenAI API error: {e}")
+            logger.error("OpenAI API error: %s", e)
             return None
         except Exception as e:
-            logger.error(f"Unexpected error in OpenAI service: {e}")
+            logger.error("Unexpected error in OpenAI service: %s", e)
             return None
 
-    def create_system_message(self) -> OpenAIMessage:
-        """Create a system message to define the bot's behavior."""
-        system_prompt = """You are a helpful and friendly WhatsApp chatbot assistant.
-        You should be conversational, concise, and helpful.
-        Keep responses under 500 characters when possible, as this is for WhatsApp messaging.
-        Be polite, professional, and engaging in your responses."""
+    async def stream_response(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int = 1000,
+        temperature: float = 0.7
+    ) -> AsyncIterator[str]:
+        """
+        Stream a response from OpenAI API as it is generated.
+
+        Args:
+            messages: List of conversation messages in OpenAI request format
+            max_tokens: Maximum tokens for response
+            temperature: Response creativity (0.0 to 1.0)
+
+        Yields:
+            Pieces of generated response text; nothing if the request fails before any text
+
+        Raises:
+            Exception: If the stream fails after text has been yielded, so a partial
+                response isn't mistaken for a complete one
+        """
+        streamed = False
+        try:
+            logger.debug("Making streaming OpenAI API request with %s messages", len(messages))
+
+            stream = await self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stream=True
+            )
 
-        return OpenAIMessage(role="system", content=system_prompt)
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    streamed = True
+                    yield chunk.choices[0].delta.content
+
+        except openai.AuthenticationError:
+            if streamed:
+                raise
+            logger.error("OpenAI authentication failed. Check your API key.")
+        except openai.RateLimitError:
+            if streamed:
+                raise
+            logger.error("OpenAI rate limit exceeded. Please try again later.")
+        except openai.APIError as e:
+            if streamed:
+                raise
+            logger.error("OpenAI API error: %s", e)
+        except Exception as e:
+            if streamed:
+                raise
+            logger.error("Unexpected error in OpenAI service: %s", e)
+
+    def create_system_message(self) -> OpenAIMessage:
+        """Get the system message that defines the bot's behavior."""
+        return self._system_message
 
     def create_user_message(self, content: str) -> OpenAIMessage:
         """Create a user message."""
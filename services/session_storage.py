@@ -1,87 +1,150 @@
-import json
-import pickle
-from typing import Optional, Dict, Any
-from datetime import datetime, timedelta
+import heapq
+import msgspec
+import orjson
+from typing import AsyncIterator, Optional, Dict, Any, List, Tuple
+from datetime import datetime
 import logging
-from redis import Redis, ConnectionError, TimeoutError
-from config import settings
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from redis.asyncio import BlockingConnectionPool, Connection, Redis, SSLConnection
+from redis.exceptions import ConnectionError, ResponseError, TimeoutError
+from redis.utils import HIREDIS_AVAILABLE
+from config import get_settings
+from models import Session
 
 logger = logging.getLogger(__name__)
 
+# Sorted set of user phones scored by their session's last activity timestamp
+ACTIVITY_INDEX_KEY = "whatsapp_sessions_by_activity"
+
+# Prefixes of the per-user session metadata hash and message list keys
+_KEY_PREFIX = b"whatsapp_session:"
+_MESSAGES_KEY_PREFIX = b"whatsapp_session_messages:"
+
+# Prefixes of the keys claiming a Twilio MessageSid and locking a user's session
+_MESSAGE_SID_KEY_PREFIX = b"whatsapp_message:"
+_LOCK_KEY_PREFIX = b"whatsapp_session_lock:"
+
+# Seconds a claimed MessageSid is remembered; Twilio retries deliveries well within this
+MESSAGE_SID_TTL = 3600
+
+# Number of recent MessageSids remembered in memory while Redis is unavailable
+RECENT_SIDS_MAX = 1024
+
+# Seconds a session lock is held at most, so a crashed worker can't block the user forever
+SESSION_LOCK_TIMEOUT = 120
+
+# Sessions deleted per pipeline when clearing all sessions
+DELETE_BATCH_SIZE = 5000
+
+# Seconds Redis INFO results are reused by get_storage_status
+INFO_CACHE_TTL = 5.0
+
+
+_ENCODER = msgspec.msgpack.Encoder()
+_MESSAGE_DECODER = msgspec.msgpack.Decoder(Dict[str, str])
+
 
 class SessionStorage:
     """Session storage service with Redis primary and in-memory fallback."""
 
     def __init__(self):
         self.redis_client = None
-        self.fallback_storage: Dict[str, Any] = {}
+        self.connection_pool = None
+        # Least recently used sessions are evicted first once the cap is reached
+        self.fallback_storage: "OrderedDict[str, Session]" = OrderedDict()
+        self._max_fallback_sessions = get_settings().max_fallback_sessions
+        # Min-heap of (expiry timestamp, user phone) for fallback sessions; may hold stale entries
+        self._expiry_heap: List[Tuple[int, str]] = []
+        # MessageSids claimed while Redis is unavailable, oldest first
+        self._recent_sids: "OrderedDict[str, None]" = OrderedDict()
+        self._info_cache: Optional[Dict[str, Any]] = None
+        self._info_cache_ts = 0.0
         self.use_redis = False
-        self._initialize_redis()
 
-    def _initialize_redis(self):
+    async def initialize(self):
         """Initialize Redis connection with fallback to in-memory storage."""
+        settings = get_settings()
         try:
-            if settings.redis_password:
-                self.redis_client = Redis(
-                    host=settings.redis_host,
-                    port=settings.redis_port,
-                    db=settings.redis_db,
-                    password=settings.redis_password,
-                    ssl=settings.redis_use_ssl,
-                    decode_responses=True,
-                    socket_connect_timeout=5,
-                    socket_timeout=5
-                )
-            else:
-                self.redis_client = Redis(
-                    host=settings.redis_host,
-                    port=settings.redis_port,
-                    db=settings.redis_db,
-                    ssl=settings.redis_use_ssl,
-                    decode_responses=True,
-                    socket_connect_timeout=5,
-                    socket_timeout=5
-                )
+            # Concurrent requests each check out their own socket from the pool
+            self.connection_pool = BlockingConnectionPool(
+                connection_class=SSLConnection if settings.redis_use_ssl else Connection,
+                max_connections=settings.redis_pool_size,
+                host=settings.redis_host,
+                port=settings.redis_port,
+                db=settings.redis_db,
+                password=settings.redis_password or None,
+                decode_responses=False,
+                socket_connect_timeout=5,
+                socket_timeout=5
+            )
+            self.redis_client = Redis(connection_pool=self.connection_pool)
 
             # Test Redis connection
-            self.redis_client.ping()
+            await self.redis_client.ping()
             self.use_redis = True
             logger.info("✅ Redis connection established successfully")
+            if not HIREDIS_AVAILABLE:
+                logger.warning("⚠️ hiredis is not installed; Redis replies are parsed in pure Python")
 
         except (ConnectionError, TimeoutError, Exception) as e:
             logger.warning(f"⚠️ Redis connection failed: {e}")
             logger.info("🔄 Falling back to in-memory storage")
+            if settings.worker_count > 1:
+                logger.warning(
+                    "⚠️ In-memory storage is per worker; sessions won't be shared between %d workers",
+                    settings.worker_count
+                )
             self.use_redis = False
             self.redis_client = None
+            if self.connection_pool:
+                await self.connection_pool.disconnect()
+                self.connection_pool = None
+
+    async def close(self):
+        """Close the Redis client and its connection pool if one is open."""
+        if self.redis_client:
+            await self.redis_client.aclose()
+            await self.connection_pool.disconnect()
+            self.redis_client = None
+            self.connection_pool = None
+            self.use_redis = False
 
-    def _get_redis_key(self, user_phone: str) -> str:
-        """Generate Redis key for user session."""
-        return f"whatsapp_session:{user_phone}"
-
-    def _serialize_session(self, session_data: Dict[str, Any]) -> str:
-        """Serialize session data to JSON string."""
-        # Convert datetime objects to ISO format for JSON serialization
-        serializable_data = session_data.copy()
-        if 'created_at' in serializable_data:
-            serializable_data['created_at'] = serializable_data['created_at'].isoformat()
-        if 'last_activity' in serializable_data:
-            serializable_data['last_activity'] = serializable_data['last_activity'].isoformat()
-
-        return json.dumps(serializable_data)
-
-    def _deserialize_session(self, session_json: str) -> Dict[str, Any]:
-        """Deserialize session data from JSON string."""
-        session_data = json.loads(session_json)
-
-        # Convert ISO format strings back to datetime objects
-        if 'created_at' in session_data:
-            session_data['created_at'] = datetime.fromisoformat(session_data['created_at'])
-        if 'last_activity' in session_data:
-            session_data['last_activity'] = datetime.fromisoformat(session_data['last_activity'])
-
-        return session_data
-
-    def get_session(self, user_phone: str) -> Optional[Dict[str, Any]]:
+    def _get_redis_key(self, user_phone: str) -> bytes:
+        """Generate Redis key for the hash holding a user's session metadata."""
+        return _KEY_PREFIX + user_phone.encode()
+
+    def _get_messages_key(self, user_phone: str) -> bytes:
+        """Generate Redis key for the list holding a user's session messages."""
+        return _MESSAGES_KEY_PREFIX + user_phone.encode()
+
+    def _session_from_redis(self, metadata: Dict[bytes, bytes], message_blobs: List[bytes]) -> Session:
+        """Build a session from its Redis metadata hash and message list."""
+        return Session(
+            user_phone=metadata[b'user_phone'].decode(),
+            messages=[_MESSAGE_DECODER.decode(blob) for blob in message_blobs],
+            created_at=int(metadata[b'created_at']),
+            last_activity=int(metadata[b'last_activity'])
+        )
+
+    def _deserialize_session(self, session_json: bytes) -> Session:
+        """Deserialize a session stored as a single JSON blob by older versions."""
+        session_data = orjson.loads(session_json)
+
+        # Convert ISO format timestamps written by older versions to Unix timestamps
+        for field in ('created_at', 'last_activity'):
+            if isinstance(session_data.get(field), str):
+                session_data[field] = int(datetime.fromisoformat(session_data[field]).timestamp())
+
+        return Session(
+            user_phone=session_data['user_phone'],
+            messages=session_data['messages'],
+            created_at=session_data['created_at'],
+            last_activity=session_data['last_activity']
+        )
+
+    async def get_session(self, user_phone: str) -> Optional[Session]:
         """
         Get session data for a user.
 
@@ -89,83 +152,211 @@ class SessionStorage:
             user_phone: User's phone number
 
         Returns:
-            Session data dictionary or None if not found
+            Session or None if not found
         """
         try:
             if self.use_redis and self.redis_client:
                 # Try Redis first
                 redis_key = self._get_redis_key(user_phone)
-                session_json = self.redis_client.get(redis_key)
-
-                if session_json:
-                    session_data = self._deserialize_session(session_json)
+                async with self.redis_client.pipeline(transaction=False) as pipe:
+                    pipe.hgetall(redis_key)
+                    pipe.lrange(self._get_messages_key(user_phone), 0, -1)
+                    metadata, message_blobs = await pipe.execute(raise_on_error=False)
+
+                if isinstance(metadata, ResponseError):
+                    # Sessions written by older versions are a single JSON blob; move them to the current layout
+                    session = self._deserialize_session(await self.redis_client.get(redis_key))
+                    await self.save_session(user_phone, session)
+                    logger.debug(f"Migrated session blob in Redis for {user_phone}")
+                    return session
+
+                if metadata:
+                    session = self._session_from_redis(metadata, message_blobs)
                     logger.debug(f"Retrieved session from Redis for {user_phone}")
-                    return session_data
-                else:
-                    # Check fallback storage
-                    if user_phone in self.fallback_storage:
-                        logger.debug(f"Retrieved session from fallback storage for {user_phone}")
-                        return self.fallback_storage[user_phone]
-                    return None
-            else:
-                # Use fallback storage
-                if user_phone in self.fallback_storage:
-                    logger.debug(f"Retrieved session from fallback storage for {user_phone}")
-                    return self.fallback_storage[user_phone]
-                return None
+                    return session
+
+            # Check fallback storage
+            return self._get_fallback_session(user_phone)
 
         except Exception as e:
             logger.error(f"Error retrieving session for {user_phone}: {e}")
             # Fallback to in-memory storage
-            if user_phone in self.fallback_storage:
-                logger.debug(f"Retrieved session from fallback storage after error for {user_phone}")
-                return self.fallback_storage[user_phone]
-            return None
+            return self._get_fallback_session(user_phone)
+
+    def _get_fallback_session(self, user_phone: str) -> Optional[Session]:
+        """Get a session from fallback storage, marking it as recently used."""
+        session = self.fallback_storage.get(user_phone)
+        if session is not None:
+            self.fallback_storage.move_to_end(user_phone)
+            logger.debug(f"Retrieved session from fallback storage for {user_phone}")
+        return session
+
+    def _save_fallback_session(self, user_phone: str, session: Session):
+        """Store a session in fallback storage, evicting the least recently used beyond the cap."""
+        self.fallback_storage[user_phone] = session
+        self.fallback_storage.move_to_end(user_phone)
+        while len(self.fallback_storage) > self._max_fallback_sessions:
+            evicted_phone, _ = self.fallback_storage.popitem(last=False)
+            logger.debug(f"Evicted least recently used fallback session for {evicted_phone}")
+
+        expires_at = session.last_activity + get_settings().session_ttl
+        heapq.heappush(self._expiry_heap, (expires_at, user_phone))
+
+    async def _write_session(
+        self, user_phone: str, session: Session, messages: List[Dict[str, str]], replace: bool
+    ) -> int:
+        """
+        Write session metadata and messages to Redis in a single transaction.
+
+        Args:
+            user_phone: User's phone number
+            session: Session whose metadata is written
+            messages: Messages appended to the stored message list
+            replace: Whether to delete the stored session first
 
-    def save_session(self, user_phone: str, session_data: Dict[str, Any]) -> bool:
+        Returns:
+            Length of the stored message list after the write
+        """
+        redis_key = self._get_redis_key(user_phone)
+        messages_key = self._get_messages_key(user_phone)
+        session_ttl = get_settings().session_ttl
+
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            if replace:
+                pipe.delete(redis_key, messages_key)
+            pipe.hset(redis_key, mapping={
+                'user_phone': session.user_phone,
+                'created_at': session.created_at,
+                'last_activity': session.last_activity
+            })
+            if messages:
+                pipe.rpush(messages_key, *(_ENCODER.encode(msg) for msg in messages))
+            pipe.expire(redis_key, session_ttl)
+            pipe.expire(messages_key, session_ttl)
+            pipe.zadd(ACTIVITY_INDEX_KEY, {user_phone: session.last_activity})
+            pipe.llen(messages_key)
+            *_, stored_length = await pipe.execute()
+        return stored_length
+
+    async def save_session(self, user_phone: str, session: Session, stored_message_count: int = 0) -> bool:
         """
         Save session data for a user.
 
+        Only messages after the first `stored_message_count` are sent to Redis; with
+        the default of 0 the stored session is replaced entirely.
+
         Args:
             user_phone: User's phone number
-            session_data: Session data to save
+            session: Session to save
+            stored_message_count: Number of leading messages already saved for this session
 
         Returns:
             True if saved successfully, False otherwise
         """
         try:
-            # Always save to fallback storage as backup
-            self.fallback_storage[user_phone] = session_data.copy()
-
             if self.use_redis and self.redis_client:
-                # Try to save to Redis
-                redis_key = self._get_redis_key(user_phone)
-                session_json = self._serialize_session(session_data)
+                # A session last saved to fallback storage may be missing messages in Redis
+                if user_phone in self.fallback_storage:
+                    stored_message_count = 0
 
-                # Save with TTL
-                success = self.redis_client.setex(
-                    redis_key,
-                    settings.session_ttl,
-                    session_json
+                # Append new messages, refresh the TTLs and index the session by last activity.
+                # MULTI/EXEC keeps a rewrite atomic and the length check consistent with the append
+                stored_length = await self._write_session(
+                    user_phone, session, session.messages[stored_message_count:], stored_message_count == 0
                 )
 
-                if success:
-                    logger.debug(f"Saved session to Redis for {user_phone}")
-                    return True
-                else:
-                    logger.warning(f"Failed to save session to Redis for {user_phone}")
+                # The stored messages changed since the session was loaded (e.g. it was cleared
+                # meanwhile), so the appended delta doesn't line up; rewrite the whole session once
+                if stored_length != len(session.messages) and stored_message_count:
+                    logger.warning("Stored messages out of sync for %s, rewriting session", user_phone)
+                    stored_length = await self._write_session(user_phone, session, session.messages, True)
+
+                if stored_length != len(session.messages):
+                    logger.error("Stored messages still out of sync for %s after rewriting session", user_phone)
                     return False
+
+                # Redis is the source of truth again; release any copy kept during an outage
+                self.fallback_storage.pop(user_phone, None)
+                logger.debug(f"Saved session to Redis for {user_phone}")
+                return True
             else:
                 # Only fallback storage
+                self._save_fallback_session(user_phone, session)
                 logger.debug(f"Saved session to fallback storage for {user_phone}")
                 return True
 
         except Exception as e:
             logger.error(f"Error saving session for {user_phone}: {e}")
-            # Session is still saved in fallback storage
+            # Keep the session in fallback storage until Redis recovers
+            self._save_fallback_session(user_phone, session)
             return True
 
-    def delete_session(self, user_phone: str) -> bool:
+    async def claim_message(self, message_sid: str) -> bool:
+        """
+        Claim a Twilio MessageSid so a retried delivery is handled only once.
+
+        Args:
+            message_sid: Twilio MessageSid of the incoming message
+
+        Returns:
+            True if the message was claimed, False if it was already received
+        """
+        try:
+            if self.use_redis and self.redis_client:
+                # SET NX succeeds for exactly one worker
+                claimed = await self.redis_client.set(
+                    _MESSAGE_SID_KEY_PREFIX + message_sid.encode(), b"1", nx=True, ex=MESSAGE_SID_TTL
+                )
+                return bool(claimed)
+        except Exception as e:
+            logger.error("Error claiming message %s: %s", message_sid, e)
+
+        # Fallback: remember recent MessageSids in this worker only
+        if message_sid in self._recent_sids:
+            return False
+        self._recent_sids[message_sid] = None
+        while len(self._recent_sids) > RECENT_SIDS_MAX:
+            self._recent_sids.popitem(last=False)
+        return True
+
+    @asynccontextmanager
+    async def lock_session(self, user_phone: str) -> AsyncIterator[None]:
+        """
+        Hold a Redis lock on a user's session, shared by every worker.
+
+        The lock is skipped if Redis is unavailable or it can't be acquired within
+        SESSION_LOCK_TIMEOUT; callers still serialize requests within the worker.
+
+        Args:
+            user_phone: User's phone number
+        """
+        lock = None
+        if self.use_redis and self.redis_client:
+            lock = self.redis_client.lock(
+                _LOCK_KEY_PREFIX + user_phone.encode(),
+                timeout=SESSION_LOCK_TIMEOUT,
+                blocking_timeout=SESSION_LOCK_TIMEOUT,
+                thread_local=False
+            )
+            try:
+                if not await lock.acquire():
+                    logger.warning("Timed out waiting for the session lock for %s", user_phone)
+                    lock = None
+            except Exception as e:
+                logger.error("Error acquiring the session lock for %s: %s", user_phone, e)
+                lock = None
+
+        try:
+            yield
+        finally:
+            if lock is not None:
+                try:
+                    await lock.release()
+                except Exception as e:
+                    # The lock may have expired while the session was being updated
+                    logger.warning("Error releasing the session lock for %s: %s", user_phone, e)
+
+    async def delete_session(self, user_phone: str) -> bool:
         """
         Delete session data for a user.
 
@@ -183,7 +374,10 @@ class SessionStorage:
             if self.use_redis and self.redis_client:
                 # Try to delete from Redis
                 redis_key = self._get_redis_key(user_phone)
-                deleted = self.redis_client.delete(redis_key)
+                async with self.redis_client.pipeline(transaction=False) as pipe:
+                    pipe.delete(redis_key, self._get_messages_key(user_phone))
+                    pipe.zrem(ACTIVITY_INDEX_KEY, user_phone)
+                    deleted, _ = await pipe.execute()
 
                 if deleted:
                     logger.debug(f"Deleted session from Redis for {user_phone}")
@@ -199,7 +393,44 @@ class SessionStorage:
             logger.error(f"Error deleting session for {user_phone}: {e}")
             return False
 
-    def get_all_sessions(self) -> Dict[str, Dict[str, Any]]:
+    async def delete_all_sessions(self) -> int:
+        """
+        Delete all sessions.
+
+        Returns:
+            Number of sessions deleted
+        """
+        try:
+            user_phones = set(self.fallback_storage)
+            self.fallback_storage.clear()
+            self._expiry_heap.clear()
+
+            if self.use_redis and self.redis_client:
+                pattern = _KEY_PREFIX + b"*"
+                phone_keys = [
+                    key.removeprefix(_KEY_PREFIX)
+                    async for key in self.redis_client.scan_iter(match=pattern, count=500)
+                ]
+
+                # UNLINK frees memory in the background; batches bound the size of each pipeline
+                for start in range(0, len(phone_keys), DELETE_BATCH_SIZE):
+                    batch = phone_keys[start:start + DELETE_BATCH_SIZE]
+                    async with self.redis_client.pipeline(transaction=False) as pipe:
+                        pipe.unlink(*(_KEY_PREFIX + phone_key for phone_key in batch))
+                        pipe.unlink(*(_MESSAGES_KEY_PREFIX + phone_key for phone_key in batch))
+                        pipe.zrem(ACTIVITY_INDEX_KEY, *batch)
+                        await pipe.execute()
+
+                user_phones.update(phone_key.decode() for phone_key in phone_keys)
+
+            logger.info(f"Deleted {len(user_phones)} sessions")
+            return len(user_phones)
+
+        except Exception as e:
+            logger.error(f"Error deleting all sessions: {e}")
+            return 0
+
+    async def get_all_sessions(self) -> Dict[str, Session]:
         """
         Get all active sessions (for monitoring purposes).
 
@@ -208,75 +439,120 @@ class SessionStorage:
         """
         try:
             if self.use_redis and self.redis_client:
-                # Get all session keys from Redis
-                pattern = "whatsapp_session:*"
-                keys = self.redis_client.keys(pattern)
+                # Iterate session keys with SCAN rather than a blocking KEYS call
+                pattern = _KEY_PREFIX + b"*"
+                keys = [key async for key in self.redis_client.scan_iter(match=pattern, count=500)]
+                if not keys:
+                    return {}
+
+                # Keys are bytes; derive the message list keys without decoding them
+                phone_keys = [key.removeprefix(_KEY_PREFIX) for key in keys]
+
+                # Fetch every session in a single round trip
+                async with self.redis_client.pipeline(transaction=False) as pipe:
+                    for key, phone_key in zip(keys, phone_keys):
+                        pipe.hgetall(key)
+                        pipe.lrange(_MESSAGES_KEY_PREFIX + phone_key, 0, -1)
+                    results = await pipe.execute(raise_on_error=False)
 
                 sessions = {}
-                for key in keys:
-                    user_phone = key.replace("whatsapp_session:", "")
-                    session_data = self.get_session(user_phone)
-                    if session_data:
-                        sessions[user_phone] = session_data
+                legacy_keys = []
+                legacy_phones = []
+                for key, phone_key, metadata, message_blobs in zip(keys, phone_keys, results[::2], results[1::2]):
+                    if isinstance(metadata, ResponseError):
+                        legacy_keys.append(key)
+                        legacy_phones.append(phone_key.decode())
+                    # Keys can expire between SCAN and the fetch
+                    elif metadata:
+                        sessions[phone_key.decode()] = self._session_from_redis(metadata, message_blobs)
+
+                # Sessions written by older versions are a single JSON blob
+                if legacy_keys:
+                    for user_phone, session_bytes in zip(legacy_phones, await self.redis_client.mget(legacy_keys)):
+                        if session_bytes is not None:
+                            sessions[user_phone] = self._deserialize_session(session_bytes)
 
                 return sessions
             else:
                 # Return fallback storage
-                return self.fallback_storage.copy()
+                return dict(self.fallback_storage)
 
         except Exception as e:
             logger.error(f"Error getting all sessions: {e}")
-            return self.fallback_storage.copy()
+            return dict(self.fallback_storage)
 
-    def cleanup_expired_sessions(self) -> int:
+    async def count_sessions(self) -> int:
         """
-        Clean up expired sessions.
+        Count active sessions.
 
         Returns:
-            Number of sessions cleaned up
+            Number of sessions active within the session TTL
         """
         try:
-            current_time = datetime.now()
-            expired_count = 0
-
             if self.use_redis and self.redis_client:
-                # Redis handles TTL automatically, but we can clean up fallback storage
-                expired_sessions = []
+                cutoff = int(time.time()) - get_settings().session_ttl
+                return await self.redis_client.zcount(ACTIVITY_INDEX_KEY, cutoff, "+inf")
+            else:
+                return len(self.fallback_storage)
 
-                for user_phone, session_data in self.fallback_storage.items():
-                    if 'last_activity' in session_data:
-                        last_activity = session_data['last_activity']
-                        if isinstance(last_activity, str):
-                            last_activity = datetime.fromisoformat(last_activity)
+        except Exception as e:
+            logger.error(f"Error counting sessions: {e}")
+            return len(self.fallback_storage)
 
-                        if current_time - last_activity > timedelta(seconds=settings.session_ttl):
-                            expired_sessions.append(user_phone)
+    def _cleanup_fallback_storage(self, now: int, cutoff: int) -> int:
+        """
+        Remove expired sessions from fallback storage.
 
-                # Remove expired sessions from fallback storage
-                for user_phone in expired_sessions:
-                    del self.fallback_storage[user_phone]
-                    expired_count += 1
+        Args:
+            now: Current Unix timestamp
+            cutoff: Sessions last active before this timestamp are expired
 
-                logger.info(f"Cleaned up {expired_count} expired sessions from fallback storage")
-            else:
-                # Clean up fallback storage
-                expired_sessions = []
+        Returns:
+            Number of sessions removed
+        """
+        expired_count = 0
 
-                for user_phone, session_data in self.fallback_storage.items():
-                    if 'last_activity' in session_data:
-                        last_activity = session_data['last_activity']
-                        if isinstance(last_activity, str):
-                            last_activity = datetime.fromisoformat(last_activity)
+        # Only pop entries that are due instead of scanning every session
+        while self._expiry_heap and self._expiry_heap[0][0] < now:
+            _, user_phone = heapq.heappop(self._expiry_heap)
 
-                        if current_time - last_activity > timedelta(seconds=settings.session_ttl):
-                            expired_sessions.append(user_phone)
+            # Skip entries superseded by a later save or a deletion
+            session = self.fallback_storage.get(user_phone)
+            if session is not None and session.last_activity < cutoff:
+                del self.fallback_storage[user_phone]
+                expired_count += 1
 
-                # Remove expired sessions
-                for user_phone in expired_sessions:
-                    del self.fallback_storage[user_phone]
-                    expired_count += 1
+        # Re-saves, deletions and evictions leave stale entries behind; rebuild the heap
+        # from live sessions in one pass once they outnumber the live ones
+        if len(self._expiry_heap) > 2 * len(self.fallback_storage):
+            session_ttl = get_settings().session_ttl
+            self._expiry_heap = [
+                (session.last_activity + session_ttl, user_phone)
+                for user_phone, session in self.fallback_storage.items()
+            ]
+            heapq.heapify(self._expiry_heap)
 
-                logger.info(f"Cleaned up {expired_count} expired sessions from fallback storage")
+        return expired_count
+
+    async def cleanup_expired_sessions(self) -> int:
+        """
+        Clean up expired sessions.
+
+        Returns:
+            Number of sessions cleaned up
+        """
+        try:
+            now = int(time.time())
+            cutoff = now - get_settings().session_ttl
+
+            if self.use_redis and self.redis_client:
+                # Session keys expire natively via their TTL; only trim them from the activity index
+                removed = await self.redis_client.zremrangebyscore(ACTIVITY_INDEX_KEY, "-inf", f"({cutoff}")
+                if removed:
+                    logger.info(f"Removed {removed} expired sessions from the Redis activity index")
+
+            expired_count = self._cleanup_fallback_storage(now, cutoff)
+            logger.info(f"Cleaned up {expired_count} expired sessions from fallback storage")
 
             return expired_count
 
@@ -284,7 +560,7 @@ class SessionStorage:
             logger.error(f"Error cleaning up expired sessions: {e}")
             return 0
 
-    def get_storage_status(self) -> Dict[str, Any]:
+    async def get_storage_status(self) -> Dict[str, Any]:
         """
         Get storage status information.
 
@@ -295,21 +571,32 @@ class SessionStorage:
             status = {
                 "storage_type": "redis" if self.use_redis else "in_memory",
                 "redis_connected": self.use_redis,
+                "redis_hiredis": HIREDIS_AVAILABLE,
                 "fallback_storage_count": len(self.fallback_storage)
             }
 
             if self.use_redis and self.redis_client:
                 try:
-                    # Get Redis info
-                    redis_info = self.redis_client.info()
-                    status.update({
-                        "redis_memory_used": redis_info.get("used_memory_human", "N/A"),
-                        "redis_connected_clients": redis_info.get("connected_clients", 0),
-                        "redis_uptime": redis_info.get("uptime_in_seconds", 0)
-                    })
+                    # Get Redis info, reusing recent results so frequent polling doesn't load Redis
+                    now = time.monotonic()
+                    if self._info_cache is None or now - self._info_cache_ts > INFO_CACHE_TTL:
+                        redis_info = await self.redis_client.info()
+                        self._info_cache = {
+                            "redis_memory_used": redis_info.get("used_memory_human", "N/A"),
+                            "redis_connected_clients": redis_info.get("connected_clients", 0),
+                            "redis_uptime": redis_info.get("uptime_in_seconds", 0)
+                        }
+                        self._info_cache_ts = now
+                    status.update(self._info_cache)
                 except Exception as e:
                     status["redis_info_error"] = str(e)
 
+                status.update({
+                    "redis_pool_max_connections": self.connection_pool.max_connections,
+                    "redis_pool_in_use": len(getattr(self.connection_pool, "_in_use_connections", ())),
+                    "redis_pool_available": len(getattr(self.connection_pool, "_available_connections", ()))
+                })
+
             return status
 
         except Exception as e:
@@ -1,21 +1,37 @@
+import asyncio
+import html
+import httpx
+from twilio.request_validator import RequestValidator
 from twilio.rest import Client
-from twilio.twiml.messaging_response import MessagingResponse
 from typing import Optional
 from models import TwilioResponse
-from config import settings
+from config import get_settings
 import logging
+import re
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Characters stripped from phone numbers (anything but digits and +)
+_PHONE_CLEAN_RE = re.compile(r'[^\d+]')
+
+# TwiML for a single reply message; the message text must be XML-escaped
+_TWIML_TEMPLATE = '<?xml version="1.0" encoding="UTF-8"?><Response><Message>{}</Message></Response>'
+_TWIML_ERROR = _TWIML_TEMPLATE.format("Sorry, I'm having trouble processing your message right now.")
+
 
 class TwilioService:
     """Service class for Twilio WhatsApp interactions."""
 
-    def __init__(self):
+    def __init__(self, http_client: Optional[httpx.AsyncClient] = None):
+        settings = get_settings()
         self.client = Client(settings.twilio_account_sid, settings.twilio_auth_token)
         self.phone_number = settings.twilio_phone_number
+        self.validator = RequestValidator(settings.twilio_auth_token)
+
+        # Shared client for non-blocking calls to the Twilio REST API
+        self.http_client = http_client
+        self.auth = (settings.twilio_account_sid, settings.twilio_auth_token)
+        self.messages_url = f"https://api.twilio.com/2010-04-01/Accounts/{settings.twilio_account_sid}/Messages.json"
 
     def send_message(self, to: str, body: str) -> bool:
         """
@@ -47,6 +63,42 @@ class TwilioService:
             logger.error(f"Failed to send message: {e}")
             return False
 
+    async def send_message_async(self, to: str, body: str) -> bool:
+        """
+        Send a WhatsApp message via the Twilio REST API using the shared HTTP client.
+
+        Without a shared client, the blocking Twilio SDK call runs in a worker thread.
+
+        Args:
+            to: Recipient phone number (should include whatsapp: prefix)
+            body: Message content
+
+        Returns:
+            True if message sent successfully, False otherwise
+        """
+        if self.http_client is None:
+            return await asyncio.to_thread(self.send_message, to, body)
+
+        try:
+            # Ensure the 'to' number has the whatsapp: prefix
+            if not to.startswith('whatsapp:'):
+                to = f"whatsapp:{to}"
+
+            # Send the message
+            response = await self.http_client.post(
+                self.messages_url,
+                data={"From": self.phone_number, "To": to, "Body": body},
+                auth=self.auth
+            )
+            response.raise_for_status()
+
+            logger.info(f"Message sent successfully. SID: {response.json()['sid']}")
+            return True
+
+        except Exception as e:
+            logger.error(f"Failed to send message: {e}")
+            return False
+
     def create_twiml_response(self, message: str) -> str:
         """
         Create a TwiML response for webhook handling.
@@ -58,16 +110,12 @@ class TwilioService:
             TwiML XML string
         """
         try:
-            response = MessagingResponse()
-            response.message(message)
-            return str(response)
+            return _TWIML_TEMPLATE.format(html.escape(message, quote=False))
 
         except Exception as e:
             logger.error(f"Failed to create TwiML response: {e}")
             # Return a simple error response
-            error_response = MessagingResponse()
-            error_response.message("Sorry, I'm having trouble processing your message right now.")
-            return str(error_response)
+            return _TWIML_ERROR
 
     def validate_webhook_signature(self, signature: str, url: str, params: dict) -> bool:
         """
@@ -82,9 +130,7 @@ class TwilioService:
             True if signature is valid, False otherwise
         """
         try:
-            from twilio.request_validator import RequestValidator
-            validator = RequestValidator(settings.twilio_auth_token)
-            return validator.validate(url, params, signature)
+            return self.validator.validate(url, params, signature)
         except Exception as e:
             logger.error(f"Error validating webhook signature: {e}")
             return False
@@ -104,8 +150,7 @@ class TwilioService:
             phone = phone[9:]
 
         # Remove any non-digit characters except +
-        import re
-        phone = re.sub(r'[^\d+]', '', phone)
+        phone = _PHONE_CLEAN_RE.sub('', phone)
 
         # Ensure it starts with +
         if not phone.startswith('+'):
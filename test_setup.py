@@ -7,8 +7,8 @@ Run this script to check if all dependencies and configurations are working.
 import os
 import sys
 import asyncio
+import time
 from dotenv import load_dotenv
-from datetime import datetime
 
 def test_environment():
     """Test if environment variables are properly loaded."""
@@ -77,7 +77,8 @@ def test_config():
     print("\n⚙️ Testing configuration...")
 
     try:
-        from config import settings
+        from config import get_settings
+        settings = get_settings()
         print("✅ Configuration loaded successfully")
         print(f"   - OpenAI Model: {settings.openai_model}")
         print(f"   - Host: {settings.host}")
@@ -129,7 +130,7 @@ async def test_openai_connection():
         system_message = openai_service.create_system_message()
 
         response = await openai_service.generate_response(
-            messages=[system_message, test_message],
+            messages=[system_message.to_dict(), test_message.to_dict()],
             max_tokens=50
         )
 
@@ -145,17 +146,20 @@ async def test_openai_connection():
         print(f"❌ OpenAI API connection failed: {e}")
         return False
 
-def test_redis_connection():
+async def test_redis_connection():
     """Test Redis connection if configured."""
     print("\n🔴 Testing Redis connection...")
 
     try:
         from services.session_storage import SessionStorage
         session_storage = SessionStorage()
+        await session_storage.initialize()
 
         if session_storage.use_redis:
+            storage_status = await session_storage.get_storage_status()
+            await session_storage.close()
             print("✅ Redis connection successful")
-            print(f"   - Storage type: {session_storage.get_storage_status()['storage_type']}")
+            print(f"   - Storage type: {storage_status['storage_type']}")
             return True
         else:
             print("⚠️ Redis not available, using in-memory fallback")
@@ -168,25 +172,27 @@ def test_redis_connection():
         return True  # Not critical for basic functionality
 
 
-def test_session_storage():
+async def test_session_storage():
     """Test session storage functionality."""
     print("\n💾 Testing session storage...")
 
     try:
+        from models import Session
         from services.session_storage import SessionStorage
         session_storage = SessionStorage()
+        await session_storage.initialize()
 
         # Test basic operations
         test_phone = "+1234567890"
-        test_data = {
-            'user_phone': test_phone,
-            'messages': [],
-            'created_at': datetime.now(),
-            'last_activity': datetime.now()
-        }
+        test_data = Session(
+            user_phone=test_phone,
+            messages=[],
+            created_at=int(time.time()),
+            last_activity=int(time.time())
+        )
 
         # Test save
-        save_success = session_storage.save_session(test_phone, test_data)
+        save_success = await session_storage.save_session(test_phone, test_data)
         if save_success:
             print("✅ Session save successful")
         else:
@@ -194,21 +200,22 @@ def test_session_storage():
             return False
 
         # Test retrieve
-        retrieved_data = session_storage.get_session(test_phone)
-        if retrieved_data and retrieved_data['user_phone'] == test_phone:
+        retrieved_data = await session_storage.get_session(test_phone)
+        if retrieved_data and retrieved_data.user_phone == test_phone:
             print("✅ Session retrieve successful")
         else:
             print("❌ Session retrieve failed")
             return False
 
         # Test delete
-        delete_success = session_storage.delete_session(test_phone)
+        delete_success = await session_storage.delete_session(test_phone)
         if delete_success:
             print("✅ Session delete successful")
         else:
             print("❌ Session delete failed")
             return False
 
+        await session_storage.close()
         return True
 
     except Exception as e:
@@ -216,6 +223,11 @@ def test_session_storage():
         return False
 
 
+async def run_async_tests(test_funcs):
+    """Run async tests concurrently, returning each result or the exception it raised."""
+    return await asyncio.gather(*(test_func() for test_func in test_funcs), return_exceptions=True)
+
+
 def main():
     """Run all tests."""
     print("🚀 WhatsApp Chatbot Setup Test")
@@ -226,13 +238,17 @@ def main():
         ("Package Imports", test_imports),
         ("Configuration", test_config),
         ("Service Initialization", test_services),
+    ]
+
+    async_tests = [
         ("Redis Connection", test_redis_connection),
         ("Session Storage", test_session_storage),
+        ("OpenAI API Connection", test_openai_connection),
     ]
 
     results = []
 
-    # Run synchronous tests
+    # Run tests
     for test_name, test_func in tests:
         try:
             result = test_func()
@@ -241,13 +257,19 @@ def main():
             print(f"❌ {test_name} test failed with exception: {e}")
             results.append((test_name, False))
 
-    # Run async test
+    # Run async tests concurrently on a single event loop
+    loop = asyncio.new_event_loop()
     try:
-        result = asyncio.run(test_openai_connection())
-        results.append(("OpenAI API Connection", result))
-    except Exception as e:
-        print(f"❌ OpenAI API Connection test failed with exception: {e}")
-        results.append(("OpenAI API Connection", False))
+        async_results = loop.run_until_complete(run_async_tests([test_func for _, test_func in async_tests]))
+    finally:
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+    for (test_name, _), result in zip(async_tests, async_results):
+        if isinstance(result, BaseException):
+            print(f"❌ {test_name} test failed with exception: {result}")
+            result = False
+        results.append((test_name, result))
 
     # Summary
     print("\n" + "=" * 40)